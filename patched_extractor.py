@@ -13,33 +13,77 @@ Based on detailed guidance for handling:
 
 import os
 import re
-import json
-import PyPDF2
+import orjson
+import pypdfium2 as pdfium
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 import logging
-import cv2
 import numpy as np
-from pdf2image import convert_from_path
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Filename keywords (lowercase, "_" separated) mapped to subjects. Applications is listed
+# first because its filenames also contain "mathematics".
+SUBJECT_KEYWORDS = {
+    'applications_of_mathematics': 'Applications_of_Mathematics',
+    'mathematics_paper': 'Mathematics'
+}
+
+# Question numbers like "5." and sub-parts like "(a)", allowing for stray spaces or newlines
+QUESTION_NUMBER_RE = re.compile(r'(?:^|\n|\s)(\d+)\.(?:\s|\n)')
+SUB_PART_RE = re.compile(r'(?:^|\n|\s)\(([a-z])\)(?:\s|\n)')
+
+# Height (points) of the page bands holding running headers, barcodes and page numbers,
+# which are left out when extracting question text
+PAGE_HEADER_HEIGHT = 36
+PAGE_FOOTER_HEIGHT = 36
+
+# Common headers and footers removed by _clean_text. Each pattern is paired with a
+# lowercase literal that any match must contain, so absent patterns can be skipped.
+NOISE_PATTERNS = [
+    ('margin', re.compile(r'MARKS\s+DO\s+NOT\s+WRITE\s+IN\s+THIS\s+MARGIN', re.IGNORECASE)),
+    ('page', re.compile(r'page\s+\d+', re.IGNORECASE)),
+    ('qualifications', re.compile(r'National\s+Qualifications', re.IGNORECASE)),
+    ('mathematics', re.compile(r'National\s+5\s+Mathematics', re.IGNORECASE)),
+    ('applications', re.compile(r'National\s+5\s+Applications\s+of\s+Mathematics', re.IGNORECASE)),
+    ('sqa', re.compile(r'SQA\s+\|', re.IGNORECASE)),
+    ('authority', re.compile(r'Scottish\s+Qualifications\s+Authority', re.IGNORECASE)),
+    ('formulae', re.compile(r'FORMULAE\s+LIST', re.IGNORECASE)),
+    ('calculator', re.compile(r'YOU\s+MAY\s+(?:NOT\s+)?USE\s+A\s+CALCULATOR', re.IGNORECASE)),
+    ('*x', re.compile(r'\*X\d+\*', re.IGNORECASE)),
+    ('additional', re.compile(r'ADDITIONAL\s+SPACE\s+FOR\s+ANSWERS', re.IGNORECASE)),
+    ('write', re.compile(r'DO\s+NOT\s+WRITE\s+ON\s+THIS\s+PAGE', re.IGNORECASE)),
+    ('[blank', re.compile(r'\[BLANK\s+PAGE\]', re.IGNORECASE)),
+    ('[turn over]', re.compile(r'\[Turn over\]', re.IGNORECASE)),
+    ('[end of question paper]', re.compile(r'\[END OF QUESTION PAPER\]', re.IGNORECASE))
+]
+
+# Question metadata scanned in one left-to-right pass: marks like "3 marks" or "(2)"
+# and units of measurement. The marks are matched in lookaheads so that the letters of
+# "marks" are still scanned for units, as a separate units search would do
+METADATA_RE = re.compile(
+    r'(?=(?P<marks>\d+)\s*marks?)'
+    r'|(?=\((?P<paren_marks>\d+)\))'
+    r'|(?P<unit>cm|m|km|g|kg|s|h|min|°|degrees|radians|litres|L|ml)',
+    re.IGNORECASE
+)
+
 class AdvancedPDFExtractor:
     """
     Advanced PDF extractor for Scottish National 5 exam papers.
     Handles question extraction, structure, math notation, and diagrams.
     """
     
-    def __init__(self):
+    def __init__(self) -> None:
         """Initialize the PDF extractor with default settings."""
         self.current_paper = None
         self.calculator_allowed = None
         self.questions = {}  # Dictionary to store questions by subject
         self.images = []
-        self.page_images = []
         
-    def extract_from_directory(self, input_dir, output_dir):
+    def extract_from_directory(self, input_dir: str, output_dir: str) -> None:
         """
         Process all PDF files in a directory and extract questions.
         
@@ -52,16 +96,18 @@ class AdvancedPDFExtractor:
         # Ensure output directory exists
         os.makedirs(output_dir, exist_ok=True)
         
-        # Initialize questions dictionary
-        self.questions = {
+        # Questions by subject, each paired with its (main number, sub-part) sort key
+        keyed_questions = {
             "Mathematics": [],
             "Applications_of_Mathematics": []
         }
         
         # Process each PDF file
-        for filename in os.listdir(input_dir):
-            if filename.endswith('.PDF') or filename.endswith('.pdf'):
-                pdf_path = os.path.join(input_dir, filename)
+        with os.scandir(input_dir) as entries:
+            for entry in entries:
+                filename = entry.name
+                if not (entry.is_file() and filename.lower().endswith('.pdf')):
+                    continue
                 
                 # Skip marking instruction files
                 if filename.startswith('mi_'):
@@ -75,74 +121,78 @@ class AdvancedPDFExtractor:
                     continue
                 
                 # Extract questions from the PDF
-                extracted_questions = self.extract_from_pdf(pdf_path, subject)
+                extracted_questions = self._extract_keyed_questions(entry.path, subject)
                 
                 # Add extracted questions to the appropriate subject
-                self.questions[subject].extend(extracted_questions)
+                keyed_questions[subject].extend(extracted_questions)
                 
                 logger.info(f"Extracted {len(extracted_questions)} questions from {filename}")
         
+        # Fix question numbering for all subjects
+        self.questions = {
+            subject: self._fix_question_numbering(questions, subject)
+            for subject, questions in keyed_questions.items()
+        }
+        
         # Save extracted questions to JSON files by subject
         for subject, questions in self.questions.items():
             if questions:
-                # Fix question numbering for all subjects
-                questions = self._fix_question_numbering(questions, subject)
-                
                 output_file = os.path.join(output_dir, f"{subject}_questions.json")
-                with open(output_file, 'w') as f:
-                    json.dump(questions, f, indent=2)
+                with open(output_file, 'wb') as f:
+                    f.write(orjson.dumps(questions, option=orjson.OPT_INDENT_2))
                 logger.info(f"Saved {len(questions)} questions to {output_file}")
     
-    def _fix_question_numbering(self, questions, subject):
+    def _determine_subject(self, filename: str) -> Optional[str]:
+        """
+        Determine the subject from the filename.
+        
+        Args:
+            filename (str): PDF filename
+            
+        Returns:
+            str: Subject name or None if not determined
+        """
+        # NOTE: delete the later _determine_subject in this file's tail, which overrides this one
+        # Normalise case and separators once, then take the first keyword that matches
+        name = filename.lower().replace('-', '_')
+        return next((subject for keyword, subject in SUBJECT_KEYWORDS.items() if keyword in name), None)
+    
+    def _fix_question_numbering(self, keyed_questions: List[Tuple[Tuple[int, str], dict]],
+                                subject: str) -> List[dict]:
         """
         Fix question numbering for all subjects.
         
         Args:
-            questions (list): List of question objects
+            keyed_questions (list): ((main_number, sub_part), question) pairs
             subject (str): Subject name
             
         Returns:
             list: List of question objects with fixed numbering
         """
-        # Group questions by their main number
-        question_groups = {}
-        
-        for question in questions:
-            # Extract main number and sub-part
-            parts = re.match(r'(\d+)\.(?:\s*\(([a-z])\))?', question["question_number"])
-            if parts:
-                main_num = int(parts.group(1))
-                sub_part = parts.group(2) if parts.group(2) else ""
-                
-                if main_num not in question_groups:
-                    question_groups[main_num] = []
-                
-                question_groups[main_num].append((sub_part, question))
-        
-        # Sort question groups by main number
-        sorted_groups = sorted(question_groups.items())
+        # Sort by (main number, sub-part); the sort is stable within each sub-part
+        keyed_questions.sort(key=lambda pair: pair[0])
         
         # Renumber questions sequentially
-        fixed_questions = []
-        current_num = 1
+        current_num = 0
+        previous_main_num = None
+        questions = []
         
-        for _, group in sorted_groups:
-            # Sort sub-parts alphabetically
-            sorted_group = sorted(group, key=lambda x: x[0] if x[0] else "")
+        for (main_num, sub_part), question in keyed_questions:
             
-            for sub_part, question in sorted_group:
-                if sub_part:
-                    question["question_number"] = f"{current_num}. ({sub_part})"
-                else:
-                    question["question_number"] = f"{current_num}."
-                
-                fixed_questions.append(question)
+            if main_num != previous_main_num:
+                current_num += 1
+                previous_main_num = main_num
             
-            current_num += 1
+            if sub_part:
+                question["question_number"] = f"{current_num}. ({sub_part})"
+            else:
+                question["question_number"] = f"{current_num}."
+            
+            questions.append(question)
         
-        return fixed_questions
+        return questions
     
-    def extract_from_pdf(self, pdf_path, subject):
+    def extract_from_pdf(self, pdf_path: str, subject: str) -> List[dict]:
         """
         Extract questions from a single PDF file.
         
@@ -153,36 +203,47 @@ class AdvancedPDFExtractor:
         Returns:
             list: Extracted questions
         """
+        return [question for _, question in self._extract_keyed_questions(pdf_path, subject)]
+    
+    def _extract_keyed_questions(self, pdf_path: str, subject: str) -> List[Tuple[Tuple[int, str], dict]]:
+        """
+        Extract questions from a single PDF file along with their sort keys.
+        
+        Args:
+            pdf_path (str): Path to the PDF file
+            subject (str): Subject of the exam (Mathematics or Applications of Mathematics)
+            
+        Returns:
+            list: ((main_number, sub_part), question) pairs, the keys being used by
+                _fix_question_numbering
+        """
         logger.info(f"Extracting questions from: {pdf_path}")
         
         # Set current paper information
         self.current_paper = os.path.basename(pdf_path)
         
-        # Convert PDF pages to images for OCR and diagram extraction
-        self.page_images = convert_from_path(pdf_path, dpi=300)
-        
-        # Process images for potential diagrams
-        diagrams = self._process_images_for_diagrams(pdf_path)
-        
-        # Extract text using PyPDF2
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
+        # Parse the PDF once with PDFium for text extraction; the document is closed as
+        # soon as extraction finishes
+        with pdfium.PdfDocument(pdf_path) as pdf:
+            # Process pages for potential diagrams
+            diagrams = self._process_images_for_diagrams(pdf)
             
             # Determine if calculator is allowed from first page
-            first_page_text = pdf_reader.pages[0].extract_text()
+            first_page_text = pdf[0].get_textpage().get_text_range()
             self.calculator_allowed = "You may use a calculator" in first_page_text
             
             # Skip cover page and formula sheet (usually first 2 pages)
             start_page = 2
             
-            # Process each page
-            all_text = ""
-            for page_num in range(start_page, len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
+            # Process each page, collecting parts to join once at the end
+            text_parts = []
+            for page_num in range(start_page, len(pdf)):
+                text = self._extract_page_text(pdf[page_num])
                 
                 # Add page number marker for later processing
-                all_text += f"\n\n[PAGE_{page_num+1}]\n\n{text}"
+                text_parts.append(f"\n\n[PAGE_{page_num+1}]\n\n{text}")
+        
+        all_text = "".join(text_parts)
         
         # Clean the text
         cleaned_text = self._clean_text(all_text)
@@ -192,28 +253,55 @@ class AdvancedPDFExtractor:
         
         return questions
     
-    def _process_images_for_diagrams(self, pdf_path):
+    def _extract_page_text(self, page: pdfium.PdfPage) -> str:
+        """
+        Extract the text of a page, leaving out its running header and footer.
+        
+        Args:
+            page (pypdfium2.PdfPage): Page to extract text from
+            
+        Returns:
+            str: Text inside the main content area of the page
+        """
+        width, height = page.get_size()
+        textpage = page.get_textpage()
+        
+        # PDF coordinates start at the bottom-left corner of the page
+        text = textpage.get_text_bounded(
+            left=0,
+            bottom=PAGE_FOOTER_HEIGHT,
+            right=width,
+            top=height - PAGE_HEADER_HEIGHT
+        )
+        
+        # PDFium ends lines with CRLF; the question patterns expect plain newlines
+        return text.replace('\r\n', '\n')
+    
+    def _process_images_for_diagrams(self, pdf: pdfium.PdfDocument) -> Dict[int, List[Tuple[int, int, int, int]]]:
         """
         Process PDF pages to identify and extract potential diagrams.
         
+        No diagram detector is implemented yet, so no pages are rendered.
+        
         Args:
-            pdf_path (str): Path to the PDF file
+            pdf (pypdfium2.PdfDocument): Open PDF document
             
         Returns:
-            dict: Dictionary mapping question numbers to diagram information
+            dict: Dictionary mapping page numbers to detected diagram regions
         """
         diagrams = {}
         
-        # Process each page image
-        for i, img in enumerate(self.page_images):
-            logger.info(f"Processed page {i+1} for diagrams")
-            
-            # In a real implementation, this would use computer vision to detect diagrams
-            # For now, we'll just note that diagrams were processed
-            
+        # This is a placeholder. In a real implementation, we would render each page one at
+        # a time with page.render(scale=200 / 72), which is enough for finding diagram
+        # regions, and then:
+        # 1. Detect diagram regions using CV
+        # 2. Extract diagram images
+        # 3. Associate with nearby question text
+        # 4. Store references to the extracted images
+        
         return diagrams
     
-    def _clean_text(self, text):
+    def _clean_text(self, text: str) -> str:
         """
         Clean the extracted text by removing headers, footers, and other noise.
         
@@ -223,27 +311,11 @@ class AdvancedPDFExtractor:
         Returns:
             str: Cleaned text
         """
-        # Remove common headers and footers
-        patterns = [
-            r'MARKS\s+DO\s+NOT\s+WRITE\s+IN\s+THIS\s+MARGIN',
-            r'page\s+\d+',
-            r'National\s+Qualifications',
-            r'National\s+5\s+Mathematics',
-            r'National\s+5\s+Applications\s+of\s+Mathematics',
-            r'SQA\s+\|',
-            r'Scottish\s+Qualifications\s+Authority',
-            r'FORMULAE\s+LIST',
-            r'YOU\s+MAY\s+(?:NOT\s+)?USE\s+A\s+CALCULATOR',
-            r'\*X\d+\*',
-            r'ADDITIONAL\s+SPACE\s+FOR\s+ANSWERS',
-            r'DO\s+NOT\s+WRITE\s+ON\s+THIS\s+PAGE',
-            r'\[BLANK\s+PAGE\]',
-            r'\[Turn over\]',
-            r'\[END OF QUESTION PAPER\]'
-        ]
-        
-        for pattern in patterns:
-            text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+        # Only run the header/footer patterns whose literal anchor occurs in the text
+        lowered = text.lower()
+        for anchor, pattern in NOISE_PATTERNS:
+            if anchor in lowered:
+                text = pattern.sub('', text)
         
         # Remove multiple newlines and whitespace
         text = re.sub(r'\n{3,}', '\n\n', text)
@@ -251,7 +323,8 @@ class AdvancedPDFExtractor:
         
         return text.strip()
     
-    def _extract_questions_from_cleaned_text(self, cleaned_text, subject, diagrams):
+    def _extract_questions_from_cleaned_text(self, cleaned_text: str, subject: str,
+                                             diagrams: dict) -> List[Tuple[Tuple[int, str], dict]]:
         """
         Extract questions from cleaned text.
         
@@ -261,54 +334,33 @@ class AdvancedPDFExtractor:
             diagrams (dict): Dictionary of diagram information
             
         Returns:
-            list: Extracted questions
+            list: ((main_number, sub_part), question) pairs
         """
         questions = []
         
-        # Modified pattern to match question numbers with more flexibility
-        # This handles cases where there might be spaces, newlines, or other characters
-        question_pattern = r'(?:^|\n|\s)(\d+)\.(?:\s|\n)'
-        
-        # Find all question numbers in the text
-        question_matches = list(re.finditer(question_pattern, cleaned_text))
+        # Find all question numbers in the text (already in text order)
+        question_matches = list(QUESTION_NUMBER_RE.finditer(cleaned_text))
         
-        # Store question positions and numbers
-        question_positions = []
-        for match in question_matches:
+        # Process each question, ending it at the start of the next question
+        for match, next_match in zip(question_matches, question_matches[1:] + [None]):
             question_number = match.group(1)
-            start_pos = match.start()
-            question_positions.append((question_number, start_pos))
-        
-        # Sort question positions by their position in the text
-        question_positions.sort(key=lambda x: x[1])
-        
-        # Process each question
-        for i, (question_number, start_pos) in enumerate(question_positions):
-            # Determine end position (start of next question or end of text)
-            if i < len(question_positions) - 1:
-                end_pos = question_positions[i + 1][1]
-            else:
-                end_pos = len(cleaned_text)
+            end_pos = next_match.start() if next_match else len(cleaned_text)
             
             # Extract question text
-            question_text = cleaned_text[start_pos:end_pos].strip()
+            question_text = cleaned_text[match.start():end_pos].strip()
             
             # Check for sub-parts
-            sub_parts = self._extract_sub_parts(question_text)
+            part_letters, part_starts = self._extract_sub_parts(question_text)
             
-            if sub_parts:
-                # Extract main question text (before any sub-parts)
-                main_text = question_text[:sub_parts[0][1]].strip()
+            if part_letters:
+                # Each sub-part ends where the next one starts; the last runs to the end
+                part_ends = np.empty_like(part_starts)
+                part_ends[:-1] = part_starts[1:]
+                part_ends[-1] = len(question_text)
                 
                 # Process each sub-part
-                for j, (part_letter, part_start, part_end) in enumerate(sub_parts):
-                    # Determine the end of this sub-part
-                    if j < len(sub_parts) - 1:
-                        actual_end = sub_parts[j + 1][1]
-                    else:
-                        actual_end = len(question_text)
-                    
-                    part_text = question_text[part_start:actual_end].strip()
+                for part_letter, part_start, part_end in zip(part_letters, part_starts.tolist(), part_ends.tolist()):
+                    part_text = question_text[part_start:part_end].strip()
                     
                     # Format question number as per user's example: "5. (a)"
                     formatted_number = f"{question_number}. ({part_letter})"
@@ -321,7 +373,7 @@ class AdvancedPDFExtractor:
                         []  # Diagrams placeholder
                     )
                     
-                    questions.append(question)
+                    questions.append(((int(question_number), part_letter), question))
             else:
                 # No sub-parts, process as a single question
                 formatted_number = f"{question_number}."
@@ -334,11 +386,11 @@ class AdvancedPDFExtractor:
                     []  # Diagrams placeholder
                 )
                 
-                questions.append(question)
+                questions.append(((int(question_number), ""), question))
         
         return questions
     
-    def _extract_sub_parts(self, text):
+    def _extract_sub_parts(self, text: str) -> Tuple[List[str], np.ndarray]:
         """
         Extract sub-parts from question text.
         
@@ -346,25 +398,17 @@ class AdvancedPDFExtractor:
             text (str): Question text
             
         Returns:
-            list: List of tuples (part_letter, start_position, end_position)
+            tuple: (part_letters, part_starts) - list of sub-part letters and an
+                int32 array of their start positions, both in text order
         """
-        sub_parts = []
-        
-        # Pattern for sub-parts like "(a)", "(b)", etc. with more flexibility
-        sub_part_pattern = r'(?:^|\n|\s)\(([a-z])\)(?:\s|\n)'
-        
-        # Find all sub-parts in the text
-        sub_part_matches = list(re.finditer(sub_part_pattern, text))
+        matches = list(SUB_PART_RE.finditer(text))
         
-        # Store sub-part positions and letters
-        for match in sub_part_matches:
-            part_letter = match.group(1)
-            start_pos = match.start()
-            sub_parts.append((part_letter, start_pos, match.end()))
+        part_letters = [match.group(1) for match in matches]
+        part_starts = np.fromiter((match.start() for match in matches), dtype=np.int32, count=len(matches))
         
-        return sub_parts
+        return part_letters, part_starts
     
-    def _create_question_object(self, question_number, text, subject, diagrams):
+    def _create_question_object(self, question_number: str, text: str, subject: str, diagrams: list) -> dict:
         """
         Create a structured question object.
         
@@ -377,8 +421,8 @@ class AdvancedPDFExtractor:
         Returns:
             dict: Question object
         """
-        # Extract marks
-        marks = self._extract_marks(text)
+        # Extract marks and units in a single pass over the text
+        marks, units = self._extract_marks_and_units(text)
         
         # Determine topic
         topic = self._determine_topic(text, subject)
@@ -397,7 +441,7 @@ class AdvancedPDFExtractor:
             "topic": topic,
             "metadata": {
                 "marks": marks,
-                "units": self._extract_units(text),
+                "units": units,
                 "instructions": self._extract_instructions(text),
                 "has_diagram": has_diagram,
                 "associated_formulae": math_expressions
@@ -407,34 +451,42 @@ class AdvancedPDFExtractor:
         
         return question
     
-    def _extract_marks(self, text):
+    def _extract_marks_and_units(self, text: str) -> Tuple[int, str]:
         """
-        Extract the number of marks from question text.
+        Extract the number of marks and the units from question text in one pass.
         
         Args:
             text (str): Question text
             
         Returns:
-            int: Number of marks, or 1 if not found
+            tuple: (marks, units) - number of marks, or 1 if not found, and the
+                first unit mentioned, or empty string if not found
         """
-        # Look for patterns like "3 marks" or "(2)"
-        marks_pattern = r'(\d+)\s*marks?'
-        marks_match = re.search(marks_pattern, text, re.IGNORECASE)
+        marks = None
+        paren_marks = None
+        units = ""
         
-        if marks_match:
-            return int(marks_match.group(1))
-        
-        # Alternative pattern for marks in parentheses
-        alt_pattern = r'\((\d+)\)'
-        alt_match = re.search(alt_pattern, text)
+        for match in METADATA_RE.finditer(text):
+            kind = match.lastgroup
+            
+            if kind == "marks" and marks is None:
+                marks = int(match.group(kind))
+            elif kind == "paren_marks" and paren_marks is None:
+                paren_marks = int(match.group(kind))
+            elif kind == "unit" and not units:
+                units = match.group(kind)
+            
+            # Nothing later in the text can change the result
+            if marks is not None and units:
+                break
         
-        if alt_match:
-            return int(alt_match.group(1))
+        # Marks in parentheses like "(2)" only count when there is no "3 marks" phrase
+        if marks is None:
+            marks = paren_marks if paren_marks is not None else 1
         
-        # Default to 1 mark if not specified
-        return 1
+        return marks, units
     
-    def _determine_topic(self, text, subject):
+    def _determine_topic(self, text: str, subject: str) -> str:
         """
         Determine the topic of a question based on its content.
         
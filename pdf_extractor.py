@@ -7,67 +7,381 @@ including questions, marking schemes, and visual elements.
 
 import os
 import re
-import PyPDF2
+import bisect
+import hashlib
+import pickle
+import shutil
+import tempfile
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 import pytesseract
-from pdf2image import convert_from_path
+
+# tesserocr runs tesseract in-process; fall back to pytesseract's subprocess calls without it
+try:
+    from tesserocr import PyTessBaseAPI, PSM
+except ImportError:
+    PyTessBaseAPI = None
 import cv2
 import numpy as np
 from PIL import Image
 import logging
+import threading
+from collections import deque
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Extraction results are cached here, keyed by the MD5 hash of the PDF contents, the
+# extraction mode and CACHE_VERSION. Bump the version whenever a change alters the
+# extracted content, so results from older versions are not served
+CACHE_DIR = os.path.expanduser('~/.cache/pdf_extractor')
+CACHE_VERSION = 5
+
+# Question papers: question numbers at the start of a line, and mark allocations.
+# Question text is sliced between consecutive headings rather than matched, which
+# avoids the nested quantifiers that made the engine backtrack
+QUESTION_HEADER_RE = re.compile(r'^(\d+\.)\s*', re.MULTILINE)
+MARKS_RE = re.compile(r'(\d+)\s*marks?', re.IGNORECASE)
+ALT_MARKS_RE = re.compile(r'\((\d+)(?:\s*marks?)?\)', re.IGNORECASE)
+
+# Marking instructions: question headings, the start of the next question, and
+# bulleted marking criteria
+SCHEME_QUESTION_RE = re.compile(r'(?:Question|Max mark)\s+(\d+).*?(?:(\d+)\s*marks?|\((\d+)\))', re.DOTALL)
+NEXT_QUESTION_RE = re.compile(r'Question\s+\d+')
+CRITERIA_RE = re.compile(r'[•●]\s*(\d+)\s+(.*?)(?=[•●]|\Z)', re.DOTALL)
+
+# Pages are rendered at 200 DPI, enough for OCR at under half the pixels of 300 DPI
+RENDER_SCALE = 200 / 72
+
+# Diagrams must be larger than this many rendered pixels each way, and smaller than
+# this fraction of the page so that full-page regions and scans are ignored
+DIAGRAM_MIN_SIZE = 100
+DIAGRAM_MAX_PAGE_FRACTION = 0.9
+
+# Pages whose embedded text is shorter than this are treated as scanned and OCR'd
+MIN_EMBEDDED_TEXT_LENGTH = 50
+
+# OCR words below this tesseract confidence are left out of the page text
+MIN_OCR_CONFIDENCE = 50
+
+# Word boxes parsed from tesseract's TSV output
+OCR_TOKEN_DTYPE = np.dtype([
+    ('text', object),
+    ('left', np.int32),
+    ('top', np.int32),
+    ('width', np.int32),
+    ('height', np.int32),
+    ('conf', np.float32),
+])
+
+# Scratch page buffers, kept per thread (and so per pool worker process) and reused
+# across pages instead of allocating a new image for every page when binarising for
+# diagram detection
+_page_buffers = threading.local()
+
+
+def _page_buffer(shape):
+    """
+    Get the calling thread's scratch buffer for a page of the given shape.
+    
+    Args:
+        shape (tuple): (height, width) of the page
+        
+    Returns:
+        numpy.ndarray: uint8 buffer of that shape; its contents are overwritten by the
+            next page processed on the same thread
+    """
+    buffer = getattr(_page_buffers, 'buffer', None)
+    if buffer is None or buffer.shape != shape:
+        buffer = _page_buffers.buffer = np.empty(shape, dtype=np.uint8)
+    
+    return buffer
+
+
+def _binarize_page(gray):
+    """
+    Convert a grayscale page to a black and white image.
+    
+    Args:
+        gray (numpy.ndarray): Grayscale page array
+        
+    Returns:
+        numpy.ndarray: Thresholded page with a white background, held in the calling
+            thread's scratch buffer
+    """
+    # An adaptive threshold copes with uneven contrast across the page, unlike a fixed cut-off
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10,
+                                 dst=_page_buffer(gray.shape))
+
+
+def _drop_nested_regions(regions):
+    """
+    Remove regions that lie entirely inside another region.
+    
+    Args:
+        regions (numpy.ndarray): Array of (x, y, w, h) rows
+        
+    Returns:
+        numpy.ndarray: The rows of regions not contained in any other region
+    """
+    x0, y0 = regions[:, 0], regions[:, 1]
+    x1, y1 = x0 + regions[:, 2], y0 + regions[:, 3]
+    
+    # inside[i, j] is True when region i lies within region j
+    inside = ((x0[:, None] >= x0) & (y0[:, None] >= y0) &
+              (x1[:, None] <= x1) & (y1[:, None] <= y1))
+    
+    # A region never counts as inside itself, and of identical regions the first is kept
+    identical = inside & inside.T
+    inside &= ~(identical & np.triu(np.ones_like(inside)))
+    
+    return regions[~inside.any(axis=1)]
+
+
+def _find_page_diagram_regions(page_index, gray):
+    """
+    Find regions on a page that are likely to be diagrams.
+    
+    Args:
+        page_index (int): Index of the page, counted from 0
+        gray (numpy.ndarray): Grayscale page array
+        
+    Returns:
+        tuple: (page_index, regions) where regions is a list of (x, y, w, h) boxes
+    """
+    try:
+        # Invert so that the page content is the white foreground
+        binary = _binarize_page(gray)
+        cv2.bitwise_not(binary, dst=binary)
+        page_height, page_width = binary.shape
+        
+        # Label connected regions; stats rows are (x, y, w, h, area) with row 0 the background
+        _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        widths = stats[1:, cv2.CC_STAT_WIDTH]
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        
+        # Filter out small regions and full-page regions in one vectorised comparison
+        keep = ((widths > DIAGRAM_MIN_SIZE) & (heights > DIAGRAM_MIN_SIZE) &
+                (widths < page_width * DIAGRAM_MAX_PAGE_FRACTION) &
+                (heights < page_height * DIAGRAM_MAX_PAGE_FRACTION))
+        # A shape drawn inside a frame is a separate component from the frame; keep only the
+        # outermost box so each diagram gives one crop
+        regions = _drop_nested_regions(stats[1:][keep, :4]).tolist()
+        
+        logger.info(f"Processed page {page_index+1} for diagrams")
+    except Exception as e:
+        logger.error(f"Error extracting diagrams from page {page_index+1}: {str(e)}")
+        regions = []
+    
+    return page_index, regions
+
+
+# The PDF opened by each diagram detection worker process. PDFium documents cannot be
+# shared between processes, so every worker opens its own copy
+_worker_pdf = None
+
+
+def _open_worker_pdf(pdf_path):
+    """
+    Open the PDF in a diagram detection worker process.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+    """
+    global _worker_pdf
+    _worker_pdf = pdfium.PdfDocument(pdf_path)
+
+
+def _extract_page_diagrams(task):
+    """
+    Render one page in a worker process and write out the diagrams found on it.
+    
+    Regions are found on a grayscale render of the page. Pages with regions are rendered
+    again in colour at the same scale, and the crops are cut from that render. PDFium
+    renders in BGR order, so the crops can be written by OpenCV as they are.
+    
+    Args:
+        task (tuple): (page_index, diagram_dir) giving the page to search, counted from 0,
+            and the directory to write the diagram crops to
+        
+    Returns:
+        list: Dictionaries with the page number, position and crop path of each diagram
+    """
+    page_index, diagram_dir = task
+    diagrams = []
+    
+    try:
+        page = _worker_pdf[page_index]
+        
+        # Only this page is held in memory; the bitmap is kept alive while its array is used
+        bitmap = page.render(scale=RENDER_SCALE, grayscale=True)
+        _, regions = _find_page_diagram_regions(page_index, bitmap.to_numpy())
+        
+        if regions:
+            bitmap = page.render(scale=RENDER_SCALE)
+            image = bitmap.to_numpy()
+            
+            for x, y, w, h in regions:
+                # Write the region of interest to an image file
+                img_path = os.path.join(diagram_dir, f"diagram_{page_index+1}_{len(diagrams)+1}.jpg")
+                cv2.imwrite(img_path, image[y:y+h, x:x+w])
+                
+                diagrams.append({
+                    'page_num': page_index + 1,
+                    'position': (x, y, w, h),
+                    'path': img_path
+                })
+    except Exception as e:
+        logger.error(f"Error writing diagrams from page {page_index+1}: {str(e)}")
+    
+    return diagrams
+
+
+def _parse_ocr_tsv(tsv):
+    """
+    Parse tesseract TSV output into the text and word boxes of each page.
+    
+    Args:
+        tsv (str): TSV output of tesseract, with or without its header row
+        
+    Returns:
+        dict: Maps page numbers, counted from 1, to (text, tokens) pairs where tokens
+            is an OCR_TOKEN_DTYPE array of the page's words
+    """
+    # Only level 5 rows are words; the others describe pages, blocks, paragraphs and lines
+    rows = [row for row in (line.split('\t') for line in tsv.splitlines()) if len(row) == 12 and row[0] == '5']
+    
+    # Fill pre-allocated arrays rather than growing lists of tuples
+    tokens = np.empty(len(rows), dtype=OCR_TOKEN_DTYPE)
+    page_nums = np.empty(len(rows), dtype=np.int32)
+    line_keys = []
+    for n, row in enumerate(rows):
+        tokens[n] = (row[11], int(row[6]), int(row[7]), int(row[8]), int(row[9]), float(row[10]))
+        page_nums[n] = int(row[1])
+        line_keys.append((row[2], row[3], row[4]))
+    
+    pages = {}
+    for page_num in np.unique(page_nums):
+        indices = np.flatnonzero(page_nums == page_num)
+        
+        # Rebuild the page's lines from its confident words
+        lines = {}
+        for n in indices:
+            if tokens['conf'][n] > MIN_OCR_CONFIDENCE:
+                lines.setdefault(line_keys[n], []).append(tokens['text'][n])
+        text = "\n".join(" ".join(words) for words in lines.values())
+        
+        pages[int(page_num)] = (text, tokens[indices])
+    
+    return pages
+
+
+def _needs_ocr(text):
+    """
+    Check whether a page's embedded text is too sparse to use without OCR.
+    
+    Args:
+        text (str): Embedded text of the page
+        
+    Returns:
+        bool: True if the page should be OCR'd
+    """
+    return len(text.strip()) < MIN_EMBEDDED_TEXT_LENGTH or not any(c.isalpha() for c in text)
+
+
 class PDFExtractor:
     """
     Main class for extracting content from Scottish National 5 exam papers.
     """
     
-    def __init__(self, pdf_path):
+    def __init__(self, pdf_path, batch_ocr=True):
         """
         Initialize the PDF extractor with the path to the PDF file.
         
         Args:
             pdf_path (str): Path to the PDF file to be processed
+            batch_ocr (bool): OCR all pages in a single tesseract run instead of
+                OCR'ing each page separately (only used when tesserocr is not installed)
         """
         self.pdf_path = pdf_path
+        self.batch_ocr = batch_ocr
         self.pdf_name = os.path.basename(pdf_path)
         self.is_marking_instruction = "mi_" in self.pdf_name.lower()
         self.pages = []
-        self.images = []
+        self.image_paths = []
+        self._ocr_page_indices = set()
+        self._diagram_page_indices = set()
+        self._image_dir = None
+        self._diagram_dir = None
         self.extracted_text = []
+        self._full_text = ""
         self.questions = []
         self.marking_schemes = []
         self.diagrams = []
         
         logger.info(f"Initializing PDF extractor for {self.pdf_name}")
         
-    def extract_content(self):
+    def extract_content(self, force_refresh=False):
         """
         Extract all content from the PDF file.
         
+        Args:
+            force_refresh (bool): Re-extract even if cached results exist for this PDF
+        
         Returns:
             dict: Dictionary containing extracted questions, marking schemes, and diagrams
         """
         logger.info(f"Starting content extraction for {self.pdf_name}")
         
-        # Extract text using PyPDF2
-        self._extract_text_with_pypdf()
-        
-        # Convert PDF to images for OCR and diagram extraction
-        self._convert_pdf_to_images()
-        
-        # Extract text using OCR for better accuracy
-        self._extract_text_with_ocr()
-        
-        # Identify questions or marking schemes based on file type
-        if self.is_marking_instruction:
-            self._extract_marking_schemes()
+        # Unchanged PDFs are served from the cache instead of being extracted again
+        cache_key = self._cache_key()
+        if not force_refresh and self._load_cached_content(cache_key):
+            logger.info(f"Loaded cached content for {self.pdf_name}")
         else:
-            self._extract_questions()
-            self._extract_diagrams()
+            try:
+                # Parse the PDF once for the text layer and the pages rendered for OCR
+                with pdfium.PdfDocument(self.pdf_path) as pdf:
+                    # Extract the embedded text
+                    self._extract_text_with_pdfium(pdf)
+                
+                    # Only pages without a usable text layer need OCR
+                    self._ocr_page_indices = {
+                        i for i, page in enumerate(self.pages) if _needs_ocr(page['text'])
+                    }
+                
+                    # Diagrams embedded as image objects are read from the PDF structure. Pages
+                    # without any are searched on the rendered page instead, which finds vector
+                    # drawings and scanned diagrams
+                    if not self.is_marking_instruction:
+                        self._extract_embedded_diagrams(pdf)
+                        embedded_pages = {diagram['page_num'] - 1 for diagram in self.diagrams}
+                        self._diagram_page_indices = set(range(len(self.pages))) - embedded_pages
+                
+                    # Pages needing OCR are rendered as they are OCR'd, while the document is open
+                    self._extract_text_with_ocr(pdf)
+                
+                # Worker processes render and search the pages without embedded diagram
+                # images, each page on its own, so no stack of page images is kept
+                if self._diagram_page_indices:
+                    self._extract_diagrams()
+                
+                # Combine text from both extraction methods once for all extractors
+                self._full_text = self._combine_page_text()
+                
+                # Identify questions or marking schemes based on file type
+                if self.is_marking_instruction:
+                    self._extract_marking_schemes()
+                else:
+                    self._extract_questions()
+            finally:
+                # The page images written for batch OCR are not needed once the text is extracted
+                self._release_page_images()
+            
+            self._save_cached_content(cache_key)
         
         return {
             "questions": self.questions,
@@ -75,76 +389,297 @@ class PDFExtractor:
             "diagrams": self.diagrams
         }
     
-    def _extract_text_with_pypdf(self):
-        """Extract text from PDF using PyPDF2."""
-        logger.info(f"Extracting text with PyPDF2 from {self.pdf_name}")
+    def _hash_pdf(self):
+        """
+        Compute the MD5 hash of the PDF file contents.
+        
+        Returns:
+            str: Hex digest identifying the PDF contents
+        """
+        digest = hashlib.md5()
+        with open(self.pdf_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        
+        return digest.hexdigest()
+    
+    def _cache_key(self):
+        """
+        Build the key of this PDF's cached content.
+        
+        Returns:
+            str: Key made of the PDF contents hash, the extraction mode and CACHE_VERSION
+        """
+        # The same file is read differently as marking instructions and as a question paper
+        mode = "mi" if self.is_marking_instruction else "qp"
+        return f"{self._hash_pdf()}_{mode}_v{CACHE_VERSION}"
+    
+    def _load_cached_content(self, cache_key):
+        """
+        Load previously extracted content for this PDF from the cache.
+        
+        Args:
+            cache_key (str): Key of the cached content, from _cache_key
+            
+        Returns:
+            bool: True if cached content was found and loaded
+        """
+        cache_file = os.path.join(CACHE_DIR, f"{cache_key}.pkl")
+        if not os.path.exists(cache_file):
+            return False
         
         try:
-            with open(self.pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                self.pages = []
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    self.pages.append({
-                        'page_num': page_num + 1,
-                        'text': text
-                    })
-                    
-                logger.info(f"Extracted text from {len(self.pages)} pages with PyPDF2")
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
         except Exception as e:
-            logger.error(f"Error extracting text with PyPDF2: {str(e)}")
-            raise
+            logger.warning(f"Ignoring unreadable cache file {cache_file}: {str(e)}")
+            return False
+        
+        self.pages = cached['pages']
+        self.extracted_text = cached['extracted_text']
+        self.questions = cached['questions']
+        self.marking_schemes = cached['marking_schemes']
+        
+        # Diagrams are cached as image files and referenced by path
+        self.diagrams = cached['diagrams']
+        
+        return True
     
-    def _convert_pdf_to_images(self):
-        """Convert PDF pages to images for OCR and diagram extraction."""
-        logger.info(f"Converting PDF to images for {self.pdf_name}")
+    def _save_cached_content(self, cache_key):
+        """
+        Save the extracted content for this PDF to the cache.
         
+        Args:
+            cache_key (str): Key of the cached content, from _cache_key
+        """
         try:
-            # Convert PDF to images
-            self.images = convert_from_path(
-                self.pdf_path,
-                dpi=300,  # Higher DPI for better quality
-                fmt='jpg'
-            )
-            logger.info(f"Converted {len(self.images)} pages to images")
+            diagrams_dir = os.path.join(CACHE_DIR, cache_key)
+            os.makedirs(diagrams_dir, exist_ok=True)
+            
+            # Store diagrams as image files rather than pickled images to keep the cache small.
+            # The images are moved out of the temporary directory, which is removed along with
+            # this extractor, so the returned diagrams point at the cached copies
+            for i, diagram in enumerate(self.diagrams):
+                img_path = os.path.join(diagrams_dir, f"diagram_{diagram['page_num']}_{i+1}.jpg")
+                shutil.move(diagram['path'], img_path)
+                diagram['path'] = img_path
+            
+            cache_file = os.path.join(CACHE_DIR, f"{cache_key}.pkl")
+            with open(cache_file, 'wb') as f:
+                pickle.dump({
+                    'pages': self.pages,
+                    'extracted_text': self.extracted_text,
+                    'questions': self.questions,
+                    'marking_schemes': self.marking_schemes,
+                    'diagrams': self.diagrams
+                }, f)
         except Exception as e:
-            logger.error(f"Error converting PDF to images: {str(e)}")
-            raise
+            logger.warning(f"Could not cache extracted content for {self.pdf_name}: {str(e)}")
     
-    def _extract_text_with_ocr(self):
-        """Extract text from PDF images using OCR."""
-        logger.info(f"Extracting text with OCR from {self.pdf_name}")
+    def _extract_text_with_pdfium(self, pdf):
+        """
+        Extract the embedded text of each page using PDFium.
         
-        self.extracted_text = []
+        Args:
+            pdf (pypdfium2.PdfDocument): Open PDF document
+        """
+        logger.info(f"Extracting text with PDFium from {self.pdf_name}")
         
-        for i, image in enumerate(self.images):
-            try:
-                # Convert PIL Image to numpy array for OpenCV
-                img_np = np.array(image)
-                
-                # Convert to grayscale
-                gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
-                
-                # Apply threshold to get black and white image
-                _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-                
-                # Perform OCR
-                text = pytesseract.image_to_string(binary)
-                
-                self.extracted_text.append({
-                    'page_num': i + 1,
+        try:
+            self.pages = []
+            
+            for page_num, page in enumerate(pdf):
+                # PDFium ends lines with CRLF; the extraction patterns expect plain newlines
+                text = page.get_textpage().get_text_range().replace('\r\n', '\n')
+                self.pages.append({
+                    'page_num': page_num + 1,
                     'text': text
                 })
                 
-                logger.info(f"Extracted OCR text from page {i+1}")
-            except Exception as e:
-                logger.error(f"Error extracting OCR text from page {i+1}: {str(e)}")
-                self.extracted_text.append({
-                    'page_num': i + 1,
-                    'text': ""
-                })
+            logger.info(f"Extracted text from {len(self.pages)} pages with PDFium")
+        except Exception as e:
+            logger.error(f"Error extracting text with PDFium: {str(e)}")
+            raise
+    
+    def _iter_ocr_pages(self, pdf):
+        """
+        Render the pages needing OCR one at a time.
+        
+        Args:
+            pdf (pypdfium2.PdfDocument): Open PDF document
+            
+        Yields:
+            tuple: (page_index, gray) pairs of the page index, counted from 0, and the
+                grayscale page array
+        """
+        for i in sorted(self._ocr_page_indices):
+            # Render in-process and in grayscale, so no colour conversion is needed later.
+            # The array is copied out of the bitmap, which is released with it
+            yield i, pdf[i].render(scale=RENDER_SCALE, grayscale=True).to_numpy().copy()
+    
+    def _extract_text_with_ocr(self, pdf):
+        """
+        Extract text from the pages needing OCR.
+        
+        Pages are rendered as they are OCR'd, so only the pages being worked on are held
+        in memory rather than the whole paper.
+        
+        Args:
+            pdf (pypdfium2.PdfDocument): Open PDF document
+        """
+        logger.info(f"Extracting text with OCR from {self.pdf_name}")
+        logger.info(f"Skipping OCR for {len(self.pages) - len(self._ocr_page_indices)} pages with embedded text")
+        
+        pages = self._iter_ocr_pages(pdf)
+        
+        if not self._ocr_page_indices:
+            ocr_results = []
+        elif PyTessBaseAPI is not None:
+            # The in-process API keeps the language model loaded across pages
+            with PyTessBaseAPI(psm=PSM.AUTO) as api:
+                ocr_results = [self._ocr_one_page(page, api) for page in pages]
+        elif self.batch_ocr:
+            ocr_results = self._ocr_all_pages(pages)
+        else:
+            # Tesseract runs in a subprocess per page, so threads give real parallelism.
+            # Keep each tesseract process single-threaded while they run side by side,
+            # unless a limit is already set, to avoid oversubscribing the CPU cores
+            set_thread_limit = 'OMP_THREAD_LIMIT' not in os.environ
+            if set_thread_limit:
+                os.environ['OMP_THREAD_LIMIT'] = '1'
+            
+            workers = os.cpu_count()
+            try:
+                # Submit pages as they are rendered, with at most one page per thread
+                # waiting, so rendered pages do not pile up ahead of tesseract. Results
+                # are collected in submission order, which is page order
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    pending = deque()
+                    ocr_results = []
+                    for page in pages:
+                        if len(pending) >= workers:
+                            ocr_results.append(pending.popleft().result())
+                        pending.append(executor.submit(self._ocr_one_page, page))
+                    ocr_results.extend(future.result() for future in pending)
+            finally:
+                if set_thread_limit:
+                    del os.environ['OMP_THREAD_LIMIT']
+        
+        # Pages that were not OCR'd keep their embedded text and have no word boxes
+        ocr_by_page = {result['page_num']: result for result in ocr_results}
+        self.extracted_text = [ocr_by_page.get(page['page_num'], {
+            'page_num': page['page_num'],
+            'text': page['text'],
+            'tokens': np.empty(0, dtype=OCR_TOKEN_DTYPE)
+        }) for page in self.pages]
+    
+    def _ocr_all_pages(self, pages):
+        """
+        Extract text from page images with a single tesseract run.
+        
+        Tesseract reads the page images from a list file, so the process start-up and
+        language model load happen once rather than per page. Tesseract applies its own
+        binarisation, so no thresholding is done here.
+        
+        Args:
+            pages (iterable): (page_index, gray) pairs of the pages to OCR
+        
+        Returns:
+            list: List of dictionaries with the page number, OCR text and word boxes
+                of each page
+        """
+        # Tesseract needs the pages on disk to read them from the list file. Each page is
+        # written as soon as it is rendered, so only one page is held in memory
+        self._image_dir = tempfile.TemporaryDirectory(prefix='pdf_extractor_')
+        self.image_paths = []
+        page_indices = []
+        for i, gray in pages:
+            image_path = os.path.join(self._image_dir.name, f"page_{i+1}.png")
+            cv2.imwrite(image_path, gray)
+            self.image_paths.append(image_path)
+            page_indices.append(i)
+        
+        list_path = os.path.join(self._image_dir.name, 'images.txt')
+        with open(list_path, 'w') as f:
+            f.write("\n".join(self.image_paths))
+        
+        try:
+            # TSV output carries the text and word boxes together, numbering the pages
+            # in list order
+            ocr_pages = _parse_ocr_tsv(pytesseract.image_to_data(list_path))
+            logger.info(f"Extracted OCR text from {len(self.image_paths)} pages")
+        except Exception as e:
+            logger.error(f"Error extracting OCR text: {str(e)}")
+            ocr_pages = {}
+        
+        results = []
+        for n, i in enumerate(page_indices):
+            text, tokens = ocr_pages.get(n + 1, ("", np.empty(0, dtype=OCR_TOKEN_DTYPE)))
+            results.append({
+                'page_num': i + 1,
+                'text': text,
+                'tokens': tokens
+            })
+        
+        return results
+    
+    def _ocr_one_page(self, page, api=None):
+        """
+        Extract text from a single page image using OCR.
+        
+        Args:
+            page (tuple): (page_index, gray) pair of the page index, counted from 0,
+                and the grayscale page array
+            api (tesserocr.PyTessBaseAPI, optional): In-process tesseract API to use
+                instead of running pytesseract
+            
+        Returns:
+            dict: Dictionary with the page number, its OCR text and word boxes
+        """
+        i, gray = page
+        text, tokens = "", np.empty(0, dtype=OCR_TOKEN_DTYPE)
+        
+        try:
+            # Perform OCR on the grayscale page, leaving binarisation to tesseract's own
+            # thresholding, and get the text and word boxes from a single TSV result
+            if api is not None:
+                api.SetImage(Image.fromarray(gray))
+                tsv = api.GetTSVText(0)
+            else:
+                tsv = pytesseract.image_to_data(gray)
+            
+            text, tokens = _parse_ocr_tsv(tsv).get(1, (text, tokens))
+            logger.info(f"Extracted OCR text from page {i+1}")
+        except Exception as e:
+            logger.error(f"Error extracting OCR text from page {i+1}: {str(e)}")
+        
+        return {
+            'page_num': i + 1,
+            'text': text,
+            'tokens': tokens
+        }
+    
+    def _release_page_images(self):
+        """Delete the page images written for batch OCR, if any."""
+        self.image_paths = []
+        
+        if self._image_dir is not None:
+            self._image_dir.cleanup()
+            self._image_dir = None
+    
+    def _combine_page_text(self):
+        """
+        Combine the PDFium and OCR text of all pages into one text.
+        
+        Returns:
+            str: Text of all pages joined by newlines
+        """
+        # extracted_text has an entry for every page, so the two lists pair up directly.
+        # Use the longer text for each page as it likely contains more information
+        return "\n".join(
+            page['text'] if len(page['text']) >= len(ocr['text']) else ocr['text']
+            for page, ocr in zip(self.pages, self.extracted_text)
+        )
     
     def _extract_questions(self):
         """Extract questions from the exam paper."""
@@ -152,43 +687,23 @@ class PDFExtractor:
         
         self.questions = []
         
-        # Combine text from both extraction methods for better results
-        combined_text = []
-        for i in range(len(self.pages)):
-            page_text = self.pages[i]['text']
-            if i < len(self.extracted_text):
-                ocr_text = self.extracted_text[i]['text']
-                # Use the longer text as it likely contains more information
-                if len(ocr_text) > len(page_text):
-                    combined_text.append(ocr_text)
-                else:
-                    combined_text.append(page_text)
-            else:
-                combined_text.append(page_text)
+        full_text = self._full_text
         
-        # Join all pages into one text for easier processing
-        full_text = "\n".join(combined_text)
+        # Find all question headings in a single pass; each question's text runs up to
+        # the next heading
+        headers = list(QUESTION_HEADER_RE.finditer(full_text))
+        ends = [m.start() for m in headers[1:]] + [len(full_text)]
         
-        # Regular expression to find questions
-        # Pattern looks for question numbers followed by text
-        # More specific pattern to better identify question boundaries
-        question_pattern = r'(?:^|\n)(\d+\.)\s*((?:.+\n?)+?)(?=(?:^|\n)\d+\.\s*|\Z)'
-        
-        # Find all matches
-        matches = re.findall(question_pattern, full_text, re.DOTALL)
-        
-        for match in matches:
-            question_num = match[0].strip()
-            question_text = match[1].strip()
+        for match, end in zip(headers, ends):
+            question_num = match.group(1).strip()
+            question_text = full_text[match.end():end].strip()
             
             # Extract marks information
-            marks_pattern = r'(\d+)\s*marks?'
-            marks_match = re.search(marks_pattern, question_text, re.IGNORECASE)
+            marks_match = MARKS_RE.search(question_text)
             
             # If not found in question text, try looking for marks in parentheses or at end of line
             if not marks_match:
-                alt_marks_pattern = r'\((\d+)(?:\s*marks?)?\)'
-                marks_match = re.search(alt_marks_pattern, question_text, re.IGNORECASE)
+                marks_match = ALT_MARKS_RE.search(question_text)
             
             marks = int(marks_match.group(1)) if marks_match else None
             
@@ -206,39 +721,23 @@ class PDFExtractor:
         
         self.marking_schemes = []
         
-        # Combine text from both extraction methods
-        combined_text = []
-        for i in range(len(self.pages)):
-            page_text = self.pages[i]['text']
-            if i < len(self.extracted_text):
-                ocr_text = self.extracted_text[i]['text']
-                if len(ocr_text) > len(page_text):
-                    combined_text.append(ocr_text)
-                else:
-                    combined_text.append(page_text)
-            else:
-                combined_text.append(page_text)
+        full_text = self._full_text
         
-        # Join all pages into one text
-        full_text = "\n".join(combined_text)
+        # Find where every "Question N" heading starts in a single pass
+        question_starts = [m.start() for m in NEXT_QUESTION_RE.finditer(full_text)]
         
         # Look for question numbers and associated marking criteria
-        # This pattern is more complex for marking instructions
-        question_pattern = r'(?:Question|Max mark)\s+(\d+).*?(?:(\d+)\s*marks?|\((\d+)\))'
-        
-        # Find all matches
-        matches = re.finditer(question_pattern, full_text, re.DOTALL)
+        matches = SCHEME_QUESTION_RE.finditer(full_text)
         
         for match in matches:
             question_num = match.group(1).strip()
             
             # Get the text following this match until the next question or end
             start_pos = match.end()
-            next_match = re.search(r'Question\s+\d+', full_text[start_pos:], re.DOTALL)
+            next_index = bisect.bisect_left(question_starts, start_pos)
             
-            if next_match:
-                end_pos = start_pos + next_match.start()
-                scheme_text = full_text[start_pos:end_pos]
+            if next_index < len(question_starts):
+                scheme_text = full_text[start_pos:question_starts[next_index]]
             else:
                 scheme_text = full_text[start_pos:]
             
@@ -246,8 +745,7 @@ class PDFExtractor:
             scheme_text = scheme_text.strip()
             
             # Extract marking criteria
-            criteria_pattern = r'[•●]\s*(\d+)\s+(.*?)(?=[•●]|\Z)'
-            criteria_matches = re.findall(criteria_pattern, scheme_text, re.DOTALL)
+            criteria_matches = CRITERIA_RE.findall(scheme_text)
             
             criteria = []
             for c_match in criteria_matches:
@@ -264,51 +762,77 @@ class PDFExtractor:
         
         logger.info(f"Extracted {len(self.marking_schemes)} marking schemes")
     
-    def _extract_diagrams(self):
-        """Extract diagrams and visual elements from the exam paper."""
-        logger.info(f"Extracting diagrams from {self.pdf_name}")
+    def _extract_embedded_diagrams(self, pdf):
+        """
+        Extract diagrams stored as image objects in the PDF.
+        
+        Args:
+            pdf (pypdfium2.PdfDocument): Open PDF document
+        """
+        logger.info(f"Extracting embedded diagrams from {self.pdf_name}")
         
         self.diagrams = []
+        self._diagram_dir = tempfile.TemporaryDirectory(prefix='pdf_extractor_diagrams_')
         
-        for i, image in enumerate(self.images):
+        for i, page in enumerate(pdf):
             try:
-                # Convert PIL Image to numpy array for OpenCV
-                img_np = np.array(image)
-                
-                # Convert to grayscale
-                gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
-                
-                # Apply threshold to get black and white image
-                _, binary = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+                page_width, page_height = page.get_size()
                 
-                # Find contours
-                contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                
-                # Filter contours by size to find potential diagrams
-                for j, contour in enumerate(contours):
-                    x, y, w, h = cv2.boundingRect(contour)
+                for image_object in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]):
+                    # Convert the PDF bounds (from the bottom-left, in points) to the rendered
+                    # page pixel coordinates used for diagrams found on page images
+                    left, bottom, right, top = image_object.get_bounds()
+                    x, y = int(left * RENDER_SCALE), int((page_height - top) * RENDER_SCALE)
+                    w, h = int((right - left) * RENDER_SCALE), int((top - bottom) * RENDER_SCALE)
                     
-                    # Filter out small contours and full-page contours
-                    if (w > 100 and h > 100 and w < img_np.shape[1] * 0.9 and h < img_np.shape[0] * 0.9):
-                        # Extract the region of interest
-                        roi = img_np[y:y+h, x:x+w]
-                        
-                        # Convert back to PIL Image
-                        diagram_img = Image.fromarray(roi)
-                        
-                        # Save diagram information
-                        self.diagrams.append({
-                            'page_num': i + 1,
-                            'position': (x, y, w, h),
-                            'image': diagram_img
-                        })
-                
-                logger.info(f"Processed page {i+1} for diagrams")
+                    # Skip icons and full-page images such as scans
+                    if (w <= DIAGRAM_MIN_SIZE or h <= DIAGRAM_MIN_SIZE or
+                            right - left >= page_width * DIAGRAM_MAX_PAGE_FRACTION or
+                            top - bottom >= page_height * DIAGRAM_MAX_PAGE_FRACTION):
+                        continue
+                    
+                    # Save the image at its original resolution rather than a rendered crop
+                    image = image_object.get_bitmap(render=False).to_pil()
+                    if image.mode not in ('L', 'RGB'):
+                        image = image.convert('RGB')
+                    img_path = os.path.join(self._diagram_dir.name, f"diagram_{i+1}_{len(self.diagrams)+1}.jpg")
+                    image.save(img_path)
+                    
+                    self.diagrams.append({
+                        'page_num': i + 1,
+                        'position': (x, y, w, h),
+                        'path': img_path
+                    })
             except Exception as e:
-                logger.error(f"Error extracting diagrams from page {i+1}: {str(e)}")
+                logger.error(f"Error extracting embedded diagrams from page {i+1}: {str(e)}")
         
-        logger.info(f"Extracted {len(self.diagrams)} potential diagrams")
-
+        logger.info(f"Extracted {len(self.diagrams)} embedded diagrams")
+    
+    def _extract_diagrams(self):
+        """
+        Extract diagrams and visual elements from the rendered pages.
+        
+        Only pages without embedded diagram images are searched. The diagrams found are
+        added to those from _extract_embedded_diagrams, whose directory they share.
+        
+        Each worker process opens its own copy of the PDF and renders the pages it is
+        given, so pages are passed by index instead of as page images.
+        """
+        logger.info(f"Extracting diagrams from {self.pdf_name}")
+        
+        tasks = [(i, self._diagram_dir.name) for i in sorted(self._diagram_page_indices)]
+        
+        with multiprocessing.Pool(min(os.cpu_count(), len(tasks)), initializer=_open_worker_pdf,
+                                  initargs=(self.pdf_path,)) as pool:
+            # map() returns the diagrams in page order
+            for page_diagrams in pool.map(_extract_page_diagrams, tasks):
+                self.diagrams.extend(page_diagrams)
+        
+        # Keep the diagrams of both sources in page order
+        self.diagrams.sort(key=lambda diagram: diagram['page_num'])
+        
+        logger.info(f"Extracted {len(self.diagrams)} diagrams in total")
+    
     def save_extracted_content(self, output_dir):
         """
         Save extracted content to the specified directory.
@@ -324,24 +848,29 @@ class PDFExtractor:
         # Save questions to text file
         if self.questions:
             questions_file = os.path.join(output_dir, f"{self.pdf_name}_questions.txt")
-            with open(questions_file, 'w') as f:
-                for q in self.questions:
-                    f.write(f"Question {q['question_num']}\n")
-                    f.write(f"Marks: {q['marks']}\n")
-                    f.write(f"{q['text']}\n\n")
+            # Build the whole file first so it is written in one call
+            content = "".join(
+                f"Question {q['question_num']}\nMarks: {q['marks']}\n{q['text']}\n\n"
+                for q in self.questions
+            )
+            with open(questions_file, 'w', buffering=64 * 1024) as f:
+                f.write(content)
             logger.info(f"Saved questions to {questions_file}")
         
         # Save marking schemes to text file
         if self.marking_schemes:
             schemes_file = os.path.join(output_dir, f"{self.pdf_name}_marking_schemes.txt")
-            with open(schemes_file, 'w') as f:
-                for scheme in self.marking_schemes:
-                    f.write(f"Question {scheme['question_num']}\n")
-                    f.write(f"{scheme['text']}\n")
-                    f.write("Criteria:\n")
-                    for criterion in scheme.get('criteria', []):
-                        f.write(f"• {criterion['points']} - {criterion['description']}\n")
-                    f.write("\n")
+            parts = []
+            for scheme in self.marking_schemes:
+                parts.append(f"Question {scheme['question_num']}\n{scheme['text']}\nCriteria:\n")
+                parts.extend(
+                    f"• {criterion['points']} - {criterion['description']}\n"
+                    for criterion in scheme.get('criteria', [])
+                )
+                parts.append("\n")
+            
+            with open(schemes_file, 'w', buffering=64 * 1024) as f:
+                f.write("".join(parts))
             logger.info(f"Saved marking schemes to {schemes_file}")
         
         # Save diagrams as images
@@ -351,7 +880,13 @@ class PDFExtractor:
             
             for i, diagram in enumerate(self.diagrams):
                 img_path = os.path.join(diagrams_dir, f"diagram_{diagram['page_num']}_{i+1}.jpg")
-                diagram['image'].save(img_path)
+                
+                # Temporary crops are moved into place; cached crops must stay in the cache
+                if self._diagram_dir and os.path.dirname(diagram['path']) == self._diagram_dir.name:
+                    shutil.move(diagram['path'], img_path)
+                    diagram['path'] = img_path
+                else:
+                    shutil.copyfile(diagram['path'], img_path)
             
             logger.info(f"Saved {len(self.diagrams)} diagrams to {diagrams_dir}")
         
@@ -13,18 +13,159 @@ Based on detailed guidance for handling:
 
 import os
 import re
-import json
-import PyPDF2
+import tempfile
+import orjson
+import pypdfium2 as pdfium
 from pathlib import Path
 import logging
-import cv2
-import numpy as np
-from pdf2image import convert_from_path
+from concurrent.futures import ProcessPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Common headers and footers removed from the extracted text, combined into one
+# alternation so they are all removed in a single pass
+NOISE_RE = re.compile('|'.join((
+    r'MARKS\s+DO\s+NOT\s+WRITE\s+IN\s+THIS\s+MARGIN',
+    r'page\s+\d+',
+    r'National\s+5\s+Mathematics',
+    r'National\s+5\s+Applications\s+of\s+Mathematics',
+    r'SQA\s+\|',
+    r'Scottish\s+Qualifications\s+Authority',
+    r'FORMULAE\s+LIST',
+    r'YOU\s+MAY\s+(?:NOT\s+)?USE\s+A\s+CALCULATOR'
+)), re.IGNORECASE)
+MULTIPLE_NEWLINES_RE = re.compile(r'\n{3,}')
+MULTIPLE_SPACES_RE = re.compile(r'\s{2,}')
+
+# Lines starting a main question (e.g. "1.", "2.") or a sub-part (e.g. "(a)", "(b)");
+# each runs up to the next such line. Matched against single lines, so an empty
+# second group means the label ends the line
+MAIN_QUESTION_RE = re.compile(r'(\d+)\.(\s|$)')
+SUB_PART_RE = re.compile(r'\s*\(([a-z])\)(\s|$)')
+
+# Mark allocations like "3 marks" or "(2)"
+MARKS_RE = re.compile(r'(\d+)\s*marks?', re.IGNORECASE)
+ALT_MARKS_RE = re.compile(r'\((\d+)\)')
+
+# Keywords for each topic, in priority order
+TOPIC_KEYWORDS = {
+    "algebraic": ["equation", "expression", "simplify", "expand", "factorise", "solve"],
+    "equations": ["equation", "solve", "solution", "unknown", "variable"],
+    "trigonometry": ["sine", "cosine", "tangent", "angle", "triangle", "sin", "cos", "tan"],
+    "geometry": ["circle", "triangle", "rectangle", "square", "polygon", "area", "volume", "perimeter"],
+    "statistics": ["mean", "median", "mode", "range", "standard deviation", "probability", "data"]
+}
+TOPIC_PRIORITY = {topic: i for i, topic in enumerate(TOPIC_KEYWORDS)}
+
+# All topic keywords in one alternation with a named group per topic, so a single scan
+# finds every topic mentioned; a keyword listed under two topics reports the first
+TOPIC_RE = re.compile('|'.join(
+    rf'\b(?P<{topic}>' + '|'.join(keywords) + r')\b'
+    for topic, keywords in TOPIC_KEYWORDS.items()
+), re.IGNORECASE)
+
+# Common units in mathematics questions
+UNITS_RE = re.compile(r'(?:cm|m|km|g|kg|s|h|min|°|degrees|radians|litres|L|ml)', re.IGNORECASE)
+
+# Common instruction phrases in priority order, and the first sentence as a fallback.
+# The phrases are combined into one scan with a group per phrase; the lookahead lets
+# a phrase start inside another phrase's sentence, as it could when each was searched
+# separately
+INSTRUCTION_PHRASES = [
+    'Calculate',
+    'Find',
+    'Determine',
+    'Express',
+    'Solve',
+    'Simplify',
+    'Expand',
+    'Factorise',
+    'Write down',
+    'Show that'
+]
+INSTRUCTION_RE = re.compile(
+    '(?=' + '|'.join(rf'({phrase}[^.]*\.)' for phrase in INSTRUCTION_PHRASES) + ')'
+)
+FIRST_SENTENCE_RE = re.compile(r'([^.]*\.)')
+
+def _process_one_pdf(pdf_path, subject, shard_path):
+    """
+    Extract questions from a single PDF file in a worker process.
+    
+    The questions are written to a JSON Lines shard rather than returned, so they are
+    not sent back to and held by the parent process.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        subject (str): Subject of the exam
+        shard_path (str): Path of the JSON Lines file to write the questions to
+        
+    Returns:
+        tuple: (subject, shard_path, count) for the PDF
+    """
+    questions = AdvancedPDFExtractor().extract_from_pdf(pdf_path, subject)
+    with open(shard_path, 'wb') as f:
+        f.write(b''.join(orjson.dumps(q) + b'\n' for q in questions))
+    
+    return subject, shard_path, len(questions)
+
+def _split_labelled_blocks(text, label_re):
+    """
+    Split text into blocks at the lines that start with a label.
+    
+    Args:
+        text (str): Text to split
+        label_re (re.Pattern): Line pattern whose first group is the label
+        
+    Returns:
+        list: (label, block text) tuples; text before the first label is dropped
+    """
+    lines = text.split('\n')
+    last_line = len(lines) - 1
+    blocks = []
+    label = None
+    
+    for i, line in enumerate(lines):
+        match = label_re.match(line)
+        
+        # A label must be followed by whitespace, which the newline provides on all
+        # but the last line
+        if match and (match.group(2) or i < last_line):
+            if label is not None:
+                blocks.append((label, '\n'.join(block_lines).strip()))
+            label = match.group(1)
+            block_lines = [line[match.end():]]
+        elif label is not None:
+            block_lines.append(line)
+    
+    if label is not None:
+        blocks.append((label, '\n'.join(block_lines).strip()))
+    
+    return blocks
+
+def _convert_jsonl_to_json(jsonl_paths, json_path):
+    """
+    Concatenate JSON Lines files into one indented JSON array, one record at a time.
+    
+    Args:
+        jsonl_paths (list): Paths of the JSON Lines files to read, in output order
+        json_path (str): Path to the JSON file to write
+    """
+    with open(json_path, 'wb') as dst:
+        dst.write(b'[')
+        separator = b'\n'
+        for jsonl_path in jsonl_paths:
+            with open(jsonl_path, 'rb') as src:
+                for line in src:
+                    # Indent each record as it would be inside the full array, then drop
+                    # the single-element array's own brackets
+                    record = orjson.dumps([orjson.loads(line)], option=orjson.OPT_INDENT_2)
+                    dst.write(separator + record[2:-2])
+                    separator = b',\n'
+        dst.write(b'\n]' if separator == b',\n' else b']')
+
 class AdvancedPDFExtractor:
     """
     Advanced PDF extractor for Scottish National 5 exam papers.
@@ -35,9 +176,7 @@ class AdvancedPDFExtractor:
         """Initialize the PDF extractor with default settings."""
         self.current_paper = None
         self.calculator_allowed = None
-        self.questions = {}  # Dictionary to store questions by subject
         self.images = []
-        self.page_images = []
         
     def extract_from_directory(self, input_dir, output_dir):
         """
@@ -52,43 +191,61 @@ class AdvancedPDFExtractor:
         # Ensure output directory exists
         os.makedirs(output_dir, exist_ok=True)
         
-        # Initialize questions dictionary
-        self.questions = {
-            "Mathematics": [],
-            "Applications_of_Mathematics": []
+        # Find the PDF files; scandir entries carry the file type, so no extra stat is needed
+        with os.scandir(input_dir) as entries:
+            pdf_entries = [
+                entry for entry in entries
+                if entry.is_file() and entry.name.lower().endswith('.pdf')
+            ]
+        
+        # Each worker writes its paper's questions to its own JSON Lines shard, so no
+        # questions are sent back to or accumulated in this process
+        question_counts = {
+            "Mathematics": 0,
+            "Applications_of_Mathematics": 0
         }
-        
-        # Process each PDF file
-        for filename in os.listdir(input_dir):
-            if filename.endswith('.PDF') or filename.endswith('.pdf'):
-                pdf_path = os.path.join(input_dir, filename)
-                
-                # Skip marking instruction files
-                if filename.startswith('mi_'):
-                    logger.info(f"Skipping marking instruction file: {filename}")
-                    continue
-                
-                # Determine subject from filename
-                subject = self._determine_subject(filename)
-                if not subject:
-                    logger.warning(f"Could not determine subject for {filename}, skipping")
-                    continue
-                
-                # Extract questions from the PDF
-                extracted_questions = self.extract_from_pdf(pdf_path, subject)
-                
-                # Add extracted questions to the appropriate subject
-                self.questions[subject].extend(extracted_questions)
+        shard_files = {subject: [] for subject in question_counts}
+        
+        # The shard directory is removed even if a worker fails
+        with tempfile.TemporaryDirectory(dir=output_dir) as shard_dir:
+            # Process each PDF file in its own worker process, as the papers are independent
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                futures = []
+                for entry in pdf_entries:
+                    filename = entry.name
+                    
+                    # Skip marking instruction files
+                    if filename.startswith('mi_'):
+                        logger.info(f"Skipping marking instruction file: {filename}")
+                        continue
+                    
+                    # Determine subject from filename
+                    subject = self._determine_subject(filename)
+                    if not subject:
+                        logger.warning(f"Could not determine subject for {filename}, skipping")
+                        continue
+                    
+                    # Extract questions from the PDF
+                    shard_path = os.path.join(shard_dir, f"{len(futures)}.jsonl")
+                    futures.append((filename, executor.submit(_process_one_pdf, entry.path, subject, shard_path)))
                 
-                logger.info(f"Extracted {len(extracted_questions)} questions from {filename}")
-        
-        # Save extracted questions to JSON files by subject
-        for subject, questions in self.questions.items():
-            if questions:
-                output_file = os.path.join(output_dir, f"{subject}_questions.json")
-                with open(output_file, 'w') as f:
-                    json.dump(questions, f, indent=2)
-                logger.info(f"Saved {len(questions)} questions to {output_file}")
+                # Collect the shards in directory order so the output does not depend on
+                # which paper finishes first
+                for filename, future in futures:
+                    subject, shard_path, count = future.result()
+                    
+                    # Add the paper's shard to the appropriate subject
+                    shard_files[subject].append(shard_path)
+                    question_counts[subject] += count
+                    
+                    logger.info(f"Extracted {count} questions from {filename}")
+            
+            # Concatenate the shards into JSON files by subject
+            for subject, count in question_counts.items():
+                if count:
+                    output_file = os.path.join(output_dir, f"{subject}_questions.json")
+                    _convert_jsonl_to_json(shard_files[subject], output_file)
+                    logger.info(f"Saved {count} questions to {output_file}")
     
     def extract_from_pdf(self, pdf_path, subject):
         """
@@ -106,72 +263,63 @@ class AdvancedPDFExtractor:
         # Set current paper information
         self.current_paper = os.path.basename(pdf_path)
         
-        # Convert PDF pages to images for OCR and diagram extraction
-        self.page_images = convert_from_path(pdf_path, dpi=300)
-        
-        # Process images for potential diagrams
-        diagrams = self._process_images_for_diagrams(pdf_path)
-        
-        # Extract text using PyPDF2
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            
+        # Parse the PDF once with PDFium for both text extraction and page rendering
+        with pdfium.PdfDocument(pdf_path) as pdf:
             # Determine if calculator is allowed from first page
-            first_page_text = pdf_reader.pages[0].extract_text()
+            first_page_text = pdf[0].get_textpage().get_text_range()
             self.calculator_allowed = "You may use a calculator" in first_page_text
             
             # Skip cover page and formula sheet (usually first 2 pages)
             start_page = 2
             
-            # Process each page
-            all_text = ""
-            for page_num in range(start_page, len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
+            # Process pages for potential diagrams
+            diagrams = self._process_images_for_diagrams(pdf, start_page)
+            
+            # Process each page, collecting cleaned parts to join once at the end. No page
+            # markers are added, as they would end up in the question text and nothing uses them
+            text_parts = []
+            for page_num in range(start_page, len(pdf)):
+                # PDFium ends lines with CRLF; the question patterns expect plain newlines
+                page_text = pdf[page_num].get_textpage().get_text_range().replace('\r\n', '\n')
                 
-                # Add page number marker for later processing
-                all_text += f"\n\n[PAGE_{page_num+1}]\n\n{text}"
+                # Clean each page on its own, so the headers and footers removed at its
+                # edges cannot leave blank lines between pages
+                page_text = self._clean_text(page_text)
+                if page_text:
+                    text_parts.append(page_text)
         
-        # Clean the text
-        cleaned_text = self._clean_text(all_text)
+        # Separate the cleaned pages by a single newline, so a question at the top of a page
+        # still starts its own line
+        cleaned_text = "\n".join(text_parts)
         
         # Extract questions using regex patterns
         questions = self._extract_questions(cleaned_text, subject, diagrams)
         
         return questions
     
-    def _process_images_for_diagrams(self, pdf_path):
+    def _process_images_for_diagrams(self, pdf, start_page):
         """
         Process PDF pages to identify and extract potential diagrams.
         
+        No diagram detector is implemented yet, so no pages are rendered.
+        
         Args:
-            pdf_path (str): Path to the PDF file
+            pdf (pypdfium2.PdfDocument): Open PDF document
+            start_page (int): Index of the first question page
             
         Returns:
             dict: Dictionary mapping question numbers to diagram information
         """
         diagrams = {}
         
-        # Process each page image
-        for i, img in enumerate(self.page_images):
-            logger.info(f"Processed page {i+1} for diagrams")
-            
-            # Convert PIL image to OpenCV format
-            open_cv_image = np.array(img)
-            open_cv_image = open_cv_image[:, :, ::-1].copy()  # Convert RGB to BGR
-            
-            # In a real implementation, this would use computer vision to detect diagrams
-            # For now, we'll just note that diagrams were processed
-            
-            # Store diagram information (placeholder)
-            page_num = i + 1
-            if page_num >= 3:  # Skip cover and formula pages
-                # This is a placeholder. In a real implementation, we would:
-                # 1. Detect diagram regions using CV
-                # 2. Extract diagram images
-                # 3. Associate with nearby question text
-                # 4. Store references to the extracted images
-                pass
+        # This is a placeholder. In a real implementation, we would render each page from
+        # start_page one at a time with pdf[page_num].render(scale=150 / 72).to_numpy(),
+        # which gives a BGR array OpenCV can use directly (150 DPI is enough for finding
+        # diagram regions), and then:
+        # 1. Detect diagram regions using CV
+        # 2. Extract diagram images
+        # 3. Associate with nearby question text
+        # 4. Store references to the extracted images
         
         return diagrams
     
@@ -186,23 +334,11 @@ class AdvancedPDFExtractor:
             str: Cleaned text
         """
         # Remove common headers and footers
-        patterns = [
-            r'MARKS\s+DO\s+NOT\s+WRITE\s+IN\s+THIS\s+MARGIN',
-            r'page\s+\d+',
-            r'National\s+5\s+Mathematics',
-            r'National\s+5\s+Applications\s+of\s+Mathematics',
-            r'SQA\s+\|',
-            r'Scottish\s+Qualifications\s+Authority',
-            r'FORMULAE\s+LIST',
-            r'YOU\s+MAY\s+(?:NOT\s+)?USE\s+A\s+CALCULATOR'
-        ]
-        
-        for pattern in patterns:
-            text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+        text = NOISE_RE.sub('', text)
         
         # Remove multiple newlines and whitespace
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        text = re.sub(r'\s{2,}', ' ', text)
+        text = MULTIPLE_NEWLINES_RE.sub('\n\n', text)
+        text = MULTIPLE_SPACES_RE.sub(' ', text)
         
         return text.strip()
     
@@ -220,34 +356,16 @@ class AdvancedPDFExtractor:
         """
         questions = []
         
-        # Pattern to match main question numbers (e.g., "1.", "2.", etc.)
-        main_question_pattern = r'(?:^|\n)(\d+)\.\s+(.*?)(?=(?:^|\n)\d+\.\s+|\Z)'
-        
-        # Find all main questions
-        main_matches = re.finditer(main_question_pattern, text, re.DOTALL | re.MULTILINE)
+        # Find all main questions with a single scan over the lines
+        main_questions = _split_labelled_blocks(text, MAIN_QUESTION_RE)
         
-        for match in main_matches:
-            question_number = match.group(1)
-            question_text = match.group(2).strip()
-            
+        for question_number, question_text in main_questions:
             # Check if the question has sub-parts
-            sub_part_pattern = r'(?:^|\n)\s*\(([a-z])\)\s+(.*?)(?=(?:^|\n)\s*\([a-z]\)\s+|\Z)'
-            sub_matches = re.finditer(sub_part_pattern, question_text, re.DOTALL | re.MULTILINE)
-            
-            sub_parts = list(sub_matches)
+            sub_parts = _split_labelled_blocks(question_text, SUB_PART_RE)
             
             if sub_parts:
-                # Extract the main question text (before any sub-parts)
-                main_text = question_text
-                for sub in sub_parts:
-                    # Remove sub-part text from main text
-                    sub_text = sub.group(0)
-                    main_text = main_text.replace(sub_text, '').strip()
-                
                 # Process each sub-part
-                for sub in sub_parts:
-                    sub_letter = sub.group(1)
-                    sub_text = sub.group(2).strip()
+                for sub_letter, sub_text in sub_parts:
                     
                     # Format question number as per user's example: "5. (a)"
                     formatted_number = f"{question_number}. ({sub_letter})"
@@ -328,15 +446,13 @@ class AdvancedPDFExtractor:
             int: Number of marks, or 1 if not found
         """
         # Look for patterns like "3 marks" or "(2)"
-        marks_pattern = r'(\d+)\s*marks?'
-        marks_match = re.search(marks_pattern, text, re.IGNORECASE)
+        marks_match = MARKS_RE.search(text)
         
         if marks_match:
             return int(marks_match.group(1))
         
         # Alternative pattern for marks in parentheses
-        alt_pattern = r'\((\d+)\)'
-        alt_match = re.search(alt_pattern, text)
+        alt_match = ALT_MARKS_RE.search(text)
         
         if alt_match:
             return int(alt_match.group(1))
@@ -355,23 +471,11 @@ class AdvancedPDFExtractor:
         Returns:
             str: Topic category
         """
-        # Define keywords for each topic
-        topics = {
-            "algebraic": ["equation", "expression", "simplify", "expand", "factorise", "solve"],
-            "equations": ["equation", "solve", "solution", "unknown", "variable"],
-            "trigonometry": ["sine", "cosine", "tangent", "angle", "triangle", "sin", "cos", "tan"],
-            "geometry": ["circle", "triangle", "rectangle", "square", "polygon", "area", "volume", "perimeter"],
-            "statistics": ["mean", "median", "mode", "range", "standard deviation", "probability", "data"]
-        }
-        
-        # Check for topic keywords in the text
-        for topic, keywords in topics.items():
-            for keyword in keywords:
-                if re.search(r'\b' + keyword + r'\b', text, re.IGNORECASE):
-                    return topic
+        # Find every topic mentioned in the text in one scan and pick the one with the
+        # highest priority, defaulting to "other" if no specific topic is identified
+        topics = {match.lastgroup for match in TOPIC_RE.finditer(text)}
         
-        # Default to "other" if no specific topic is identified
-        return "other"
+        return min(topics, key=TOPIC_PRIORITY.get, default="other")
     
     def _extract_units(self, text):
         """
@@ -384,8 +488,7 @@ class AdvancedPDFExtractor:
             str: Units, or empty string if not found
         """
         # Common units in mathematics questions
-        units_pattern = r'(?:cm|m|km|g|kg|s|h|min|°|degrees|radians|litres|L|ml)'
-        units_match = re.search(units_pattern, text, re.IGNORECASE)
+        units_match = UNITS_RE.search(text)
         
         if units_match:
             return units_match.group(0)
@@ -402,27 +505,19 @@ class AdvancedPDFExtractor:
         Returns:
             str: Instructions, or empty string if not found
         """
-        # Look for common instruction phrases
-        instruction_patterns = [
-            r'(Calculate[^.]*\.)',
-            r'(Find[^.]*\.)',
-            r'(Determine[^.]*\.)',
-            r'(Express[^.]*\.)',
-            r'(Solve[^.]*\.)',
-            r'(Simplify[^.]*\.)',
-            r'(Expand[^.]*\.)',
-            r'(Factorise[^.]*\.)',
-            r'(Write down[^.]*\.)',
-            r'(Show that[^.]*\.)'
-        ]
-        
-        for pattern in instruction_patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1).strip()
+        # Look for common instruction phrases, preferring phrases listed first
+        best = None
+        for match in INSTRUCTION_RE.finditer(text):
+            if best is None or match.lastindex < best.lastindex:
+                best = match
+                if best.lastindex == 1:
+                    break
+        
+        if best:
+            return best.group(best.lastindex).strip()
         
         # If no specific instruction is found, return the first sentence
-        first_sentence = re.match(r'([^.]*\.)', text)
+        first_sentence = FIRST_SENTENCE_RE.match(text)
         if first_sentence:
             return first_sentence.group(1).strip()
         
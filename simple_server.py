@@ -1,27 +1,66 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, render_template, send_from_directory, jsonify, request
+from flask import Flask, Response, render_template, send_from_directory, jsonify, request
+import hashlib
 import os
-import json
+import orjson
 
 app = Flask(__name__, 
             static_folder='build/static',
+            static_url_path='/static',
             template_folder='build')
 
-# Load question data
-def load_questions(subject):
+# Parsed question files by path, with the modification time they were read at, the
+# questions as listed on the practice pages and the serialized API payload with its ETag
+_questions_cache = {}
+
+def _load_question_file(subject):
     if subject == 'mathematics':
         file_path = 'exam_papers/N5_Mathematics_Paper1-Non-calculator_2022_questions.json'
     else:
         file_path = 'exam_papers/Applications_of_Mathematics_questions.json'
         
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        # Only re-read the file when it has changed since it was last loaded
+        mtime = os.stat(file_path).st_mtime_ns
+        cached = _questions_cache.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            return cached
+        
+        with open(file_path, 'rb') as f:
+            questions = orjson.loads(f.read())
     except Exception as e:
         print(f"Error loading questions: {e}")
-        return []
+        return None, [], [], b'[]', None
+    
+    # Build the practice page list once per load rather than on every request. Missing
+    # fields are tolerated so one incomplete record cannot empty every endpoint
+    practice_questions = [{
+        'question_id': i,
+        'question_num': q.get('question_number'),
+        'text': q.get('text'),
+        'marks': q.get('marks') if q.get('marks') is not None else '?'
+    } for i, q in enumerate(questions)]
+    
+    # Serialize the API payload once so repeat requests can be answered from its ETag
+    payload = orjson.dumps(questions)
+    etag = hashlib.md5(payload).hexdigest()
+    
+    _questions_cache[file_path] = (mtime, questions, practice_questions, payload, etag)
+    return _questions_cache[file_path]
+
+# Load question data
+def load_questions(subject):
+    return _load_question_file(subject)[1]
+
+# Load question data as listed on the practice pages
+def load_practice_questions(subject):
+    return _load_question_file(subject)[2]
+
+# Load question data as served by the API, with its ETag (None if loading failed)
+def load_questions_payload(subject):
+    return _load_question_file(subject)[3:]
 
 # Routes
 @app.route('/')
@@ -34,27 +73,15 @@ def practice():
 
 @app.route('/practice/mathematics')
 def practice_mathematics():
-    questions = load_questions('mathematics')
     return render_template('practice_subject.html', 
                           subject='Mathematics',
-                          questions=[{
-                              'question_id': i,
-                              'question_num': q['question_number'],
-                              'text': q['text'],
-                              'marks': q['marks'] if q['marks'] is not None else '?'
-                          } for i, q in enumerate(questions)])
+                          questions=load_practice_questions('mathematics'))
 
 @app.route('/practice/applications')
 def practice_applications():
-    questions = load_questions('applications')
     return render_template('practice_subject.html', 
                           subject='Applications of Mathematics',
-                          questions=[{
-                              'question_id': i,
-                              'question_num': q['question_number'],
-                              'text': q['text'],
-                              'marks': q['marks'] if q['marks'] is not None else '?'
-                          } for i, q in enumerate(questions)])
+                          questions=load_practice_questions('applications'))
 
 @app.route('/question/<int:question_id>')
 def question(question_id):
@@ -89,17 +116,21 @@ def upload():
 def admin():
     return send_from_directory('build', 'admin.html')
 
-@app.route('/static/<path:path>')
-def serve_static(path):
-    return send_from_directory('build/static', path)
-
 @app.route('/api/questions/<subject>')
 def api_questions(subject):
     if subject not in ['mathematics', 'applications']:
         return jsonify({"error": "Invalid subject"}), 400
     
-    questions = load_questions(subject)
-    return jsonify(questions)
+    payload, etag = load_questions_payload(subject)
+    resp = Response(payload, mimetype='application/json')
+    
+    # Let clients cache and revalidate loaded questions, but not the empty list sent
+    # when loading failed
+    if etag is not None:
+        resp.set_etag(etag)
+        resp.cache_control.max_age = 300
+        resp.make_conditional(request)
+    return resp
 
 @app.route('/api/submit_answer', methods=['POST'])
 def submit_answer():
@@ -126,4 +157,6 @@ def submit_answer():
     })
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only; in production run under a WSGI server, e.g.
+    # gunicorn -w $(nproc) -k gthread --threads 4 simple_server:app
+    app.run(host='0.0.0.0', port=5000, threaded=True, debug=False)